@@ -0,0 +1,64 @@
+"""
+Response Cache Helpers
+
+Optional Redis-backed read-through cache for GET list endpoints.
+Set REDIS_URL to enable; without it every helper is a no-op and
+endpoints fall through to MongoDB as before.
+
+Cached values are already-serialized JSON bytes, so a cache hit skips
+both the Mongo round-trip and the orjson encode. Keys embed a
+per-collection version counter, so invalidation is a single INCR and
+stale entries simply age out via their TTL.
+"""
+
+from redis import asyncio as aioredis
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+redis_client = None
+
+redis_url = os.getenv("REDIS_URL")
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "15"))
+
+if redis_url:
+    redis_client = aioredis.from_url(redis_url)
+
+
+async def _versioned_key(collection_name: str, key: str) -> str:
+    """Build a cache key embedding the collection's current version"""
+    version = await redis_client.get(f"{collection_name}:ver")
+    version = version.decode() if version else "0"
+    return f"{collection_name}:v{version}:{key}"
+
+
+async def cache_get(collection_name: str, key: str):
+    """Return cached bytes for key, or None on miss / no Redis configured"""
+    if redis_client is None:
+        return None
+    try:
+        return await redis_client.get(await _versioned_key(collection_name, key))
+    except Exception:
+        return None
+
+
+async def cache_set(collection_name: str, key: str, value: bytes):
+    """Store serialized bytes under key with the configured TTL"""
+    if redis_client is None:
+        return
+    try:
+        await redis_client.set(await _versioned_key(collection_name, key), value, ex=CACHE_TTL_SECONDS)
+    except Exception:
+        pass
+
+
+async def cache_invalidate(collection_name: str):
+    """Bump the collection's version so all its cached responses go stale"""
+    if redis_client is None:
+        return
+    try:
+        await redis_client.incr(f"{collection_name}:ver")
+    except Exception:
+        pass
@@ -5,12 +5,15 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone
+import asyncio
 import os
 from dotenv import load_dotenv
+from types import MappingProxyType
 from typing import Union
 from pydantic import BaseModel
+from pymongo.errors import BulkWriteError
 
 # Load environment variables from .env file
 load_dotenv()
@@ -22,16 +25,38 @@ database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    # Bounded pool so burst traffic queues briefly then fails fast instead
+    # of piling up behind head-of-line blocking
+    _client = AsyncIOMotorClient(
+        database_url,
+        maxPoolSize=50,
+        minPoolSize=10,
+        waitQueueTimeoutMS=500,
+        serverSelectionTimeoutMS=2000,
+    )
     db = _client[database_name]
 
-# Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
-    """Insert a single document with timestamp"""
-    if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+# Collection handles cached once so the hot path skips the per-call
+# None-check and db[name] lookup
+_COLLS = {}
+if db is not None:
+    for _name in ("user", "appointment", "message", "questionnaireresponse", "prescription", "invoice"):
+        _COLLS[_name] = db[_name]
+
+
+_EMPTY_FILTER = MappingProxyType({})
+
 
-    # Convert Pydantic model to dict if needed
+def _coll(collection_name: str):
+    coll = _COLLS.get(collection_name)
+    if coll is None:
+        if db is None:
+            raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+        coll = _COLLS[collection_name] = db[collection_name]
+    return coll
+
+def _prepare_document(data: Union[BaseModel, dict]) -> dict:
+    """Convert a model to a dict and stamp created_at/updated_at"""
     if isinstance(data, BaseModel):
         data_dict = data.model_dump()
     else:
@@ -39,17 +64,103 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
 
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
+    return data_dict
 
-    result = db[collection_name].insert_one(data_dict)
+# Helper functions for common database operations
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
+    """Insert a single document with timestamp"""
+    data_dict = _prepare_document(data)
+    result = await _coll(collection_name).insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
-    if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
-    
-    cursor = db[collection_name].find(filter_dict or {})
+# Coalescing insert buffer for high-volume message posts: callers enqueue
+# and await their _id while a background task flushes the queue with one
+# insert_many per window, amortizing the Mongo round-trip.
+_BATCH_WINDOW = 0.01  # seconds
+_message_queue = None
+_message_flusher = None
+
+
+async def _insert_message_batch(batch):
+    docs = [doc for doc, _ in batch]
+    try:
+        result = await _coll("message").insert_many(docs, ordered=False)
+        for (_, future), inserted_id in zip(batch, result.inserted_ids):
+            if not future.done():
+                future.set_result(str(inserted_id))
+    except BulkWriteError as e:
+        # Unordered bulk failures are partial: only fail callers whose
+        # document was rejected. pymongo assigns _id client-side, so the
+        # documents that landed already carry theirs.
+        failed = {err["index"] for err in e.details.get("writeErrors", [])}
+        for index, (doc, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in failed:
+                future.set_exception(e)
+            else:
+                future.set_result(str(doc["_id"]))
+    except Exception as e:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+
+
+async def _flush_messages():
+    while True:
+        first = await _message_queue.get()
+        try:
+            await asyncio.sleep(_BATCH_WINDOW)
+        except asyncio.CancelledError:
+            # Hand the held item back so the shutdown drain inserts it
+            _message_queue.put_nowait(first)
+            raise
+        batch = [first]
+        while not _message_queue.empty():
+            batch.append(_message_queue.get_nowait())
+        # Shield so cancellation mid-insert still resolves the futures
+        await asyncio.shield(_insert_message_batch(batch))
+
+
+async def create_message_batched(data: Union[BaseModel, dict]):
+    """Insert a message through the coalescing buffer and return its id"""
+    global _message_queue, _message_flusher
+    if _message_queue is None:
+        _message_queue = asyncio.Queue()
+    if _message_flusher is None or _message_flusher.done():
+        _message_flusher = asyncio.create_task(_flush_messages())
+    data_dict = _prepare_document(data)
+    future = asyncio.get_running_loop().create_future()
+    _message_queue.put_nowait((data_dict, future))
+    return await future
+
+
+async def flush_pending_messages():
+    """Stop the background flusher and insert anything still queued"""
+    global _message_flusher
+    if _message_flusher is None:
+        return
+    _message_flusher.cancel()
+    try:
+        await _message_flusher
+    except asyncio.CancelledError:
+        pass
+    batch = []
+    while not _message_queue.empty():
+        batch.append(_message_queue.get_nowait())
+    if batch:
+        await _insert_message_batch(batch)
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None, projection: dict = None):
+    """Get documents from collection, optionally projecting a subset of fields"""
+    filter_dict = _EMPTY_FILTER if filter_dict is None else filter_dict
+    # Clamp: to_list raises ValueError on negative lengths, and the limit
+    # comes straight from a query param. Non-positive means unlimited,
+    # matching the baseline's falsy-limit handling.
+    if limit is not None and limit <= 0:
+        limit = None
+    cursor = _coll(collection_name).find(filter_dict, projection).sort("_id", -1)
     if limit:
         cursor = cursor.limit(limit)
-    
-    return list(cursor)
+
+    return await cursor.to_list(length=limit)
@@ -1,18 +1,53 @@
+import asyncio
+import hashlib
 import os
-from datetime import datetime
-from typing import List, Optional, Dict, Set
-
-from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+import re
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
+from typing import Annotated, List, Optional, Dict, Set
+
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
-from pydantic import BaseModel, Field, EmailStr
+from fastapi.responses import ORJSONResponse, RedirectResponse
+from fastapi.routing import APIRoute
+import jwt
+import msgspec
+import orjson
+from pydantic import AfterValidator, BaseModel, ConfigDict, Field
 
-from database import db, create_document, get_documents
+from database import db, create_document, create_message_batched, flush_pending_messages, get_documents
+from cache import redis_client, cache_get, cache_set, cache_invalidate
 
 # OAuth
 from authlib.integrations.starlette_client import OAuth
 
-app = FastAPI(title="Nutritionist API", version="0.3.0")
+class ORJSONRoute(APIRoute):
+    """APIRoute that parses JSON request bodies with orjson instead of stdlib json."""
+
+    def get_route_handler(self):
+        original_handler = super().get_route_handler()
+
+        # Routes without a Pydantic body (the msgspec endpoints decode the
+        # raw bytes themselves) get the plain handler so they parse once.
+        if self.body_field is None:
+            return original_handler
+
+        async def orjson_handler(request: Request) -> Response:
+            body = await request.body()
+            if body:
+                try:
+                    request._json = orjson.loads(body)
+                except orjson.JSONDecodeError:
+                    pass  # fall through so the default parser raises the usual 422
+            return await original_handler(request)
+
+        return orjson_handler
+
+
+app = FastAPI(title="Nutritionist API", version="0.3.0", default_response_class=ORJSONResponse)
+app.router.route_class = ORJSONRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,19 +57,56 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# In-band timing for load tests, gated so production keeps a minimal
+# middleware stack. Enable with PROFILE=1.
+if os.getenv("PROFILE"):
+    @app.middleware("http")
+    async def server_timing(request: Request, call_next):
+        start = time.perf_counter()
+        response = await call_next(request)
+        duration_ms = (time.perf_counter() - start) * 1000
+        response.headers["Server-Timing"] = f"app;dur={duration_ms:.2f}"
+        return response
+
 
 # ---------------------
 # Schemas (Pydantic)
 # ---------------------
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+def _validate_email(value: str) -> str:
+    if not _EMAIL_RE.match(value):
+        raise ValueError("invalid email address")
+    return value
+
+
+# Plain-str email with a precompiled regex check; avoids the much heavier
+# email_validator package that EmailStr pulls in on every parse.
+Email = Annotated[str, AfterValidator(_validate_email)]
+
+_MODEL_CONFIG = ConfigDict(
+    extra="ignore",
+    populate_by_name=False,
+    str_strip_whitespace=False,
+    validate_assignment=False,
+    frozen=True,
+)
+
+
 class User(BaseModel):
+    model_config = _MODEL_CONFIG
+
     name: str
-    email: EmailStr
+    email: Email
     role: str = Field("patient", description="patient | admin")
     avatar_url: Optional[str] = None
 
 
 class Appointment(BaseModel):
-    patient_email: EmailStr
+    model_config = _MODEL_CONFIG
+
+    patient_email: Email
     patient_name: str
     date: str = Field(..., description="ISO date, e.g., 2025-11-20")
     time: str = Field(..., description="HH:mm in 24h format")
@@ -42,15 +114,19 @@ class Appointment(BaseModel):
     status: str = Field("pending", description="pending | confirmed | canceled")
 
 
-class Message(BaseModel):
-    room: str = Field("general")
+# High-volume models use msgspec Structs: the whole body (nested items
+# included) decodes in C instead of N Pydantic constructor calls.
+class Message(msgspec.Struct):
     sender: str
-    sender_email: Optional[EmailStr] = None
     content: str
+    room: str = "general"
+    sender_email: Optional[str] = None
 
 
 class QuestionnaireResponse(BaseModel):
-    patient_email: EmailStr
+    model_config = _MODEL_CONFIG
+
+    patient_email: Email
     goals: Optional[str] = None
     allergies: Optional[str] = None
     dietary_preferences: Optional[str] = None
@@ -58,47 +134,128 @@ class QuestionnaireResponse(BaseModel):
 
 
 class Prescription(BaseModel):
-    patient_email: EmailStr
+    model_config = _MODEL_CONFIG
+
+    patient_email: Email
     patient_name: Optional[str] = None
     items: List[str] = Field(default_factory=list, description="List of supplement or diet items")
     instructions: Optional[str] = None
 
 
-class InvoiceItem(BaseModel):
+class InvoiceItem(msgspec.Struct):
     name: str
     price: float
     quantity: int = 1
 
 
-class Invoice(BaseModel):
-    patient_email: EmailStr
-    patient_name: Optional[str] = None
-    items: List[InvoiceItem] = Field(default_factory=list)
+class Invoice(msgspec.Struct):
+    patient_email: str
     subtotal: float
-    tax: float = 0.0
     total: float
+    patient_name: Optional[str] = None
+    items: List[InvoiceItem] = msgspec.field(default_factory=list)
+    tax: float = 0.0
+
+
+_MESSAGE_DECODER = msgspec.json.Decoder(Message)
+_INVOICE_DECODER = msgspec.json.Decoder(Invoice)
 
 
 # ---------------------
 # Helpers
 # ---------------------
 
-def _collection(name: str):
+# Shared immutable empty filter so unfiltered list requests allocate nothing
+_EMPTY_FILTER = MappingProxyType({})
+
+# Shed write load before it queues on the Mongo pool
+_WRITE_SEMAPHORE = asyncio.Semaphore(64)
+_WRITE_ACQUIRE_TIMEOUT = 0.5
+
+
+async def _limited_create(collection_name: str, data):
+    try:
+        await asyncio.wait_for(_WRITE_SEMAPHORE.acquire(), timeout=_WRITE_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Write capacity exhausted, try again shortly")
+    try:
+        return await create_document(collection_name, data)
+    finally:
+        _WRITE_SEMAPHORE.release()
+
+
+def _decode_struct(body: bytes, decoder: msgspec.json.Decoder):
+    try:
+        return decoder.decode(body)
+    except (msgspec.ValidationError, msgspec.DecodeError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def _orjson_default(obj):
+    # Non-native types (bson.ObjectId) stringify; datetimes serialize in C.
+    return str(obj)
+
+
+@app.on_event("startup")
+async def ensure_indexes():
+    """Create the indexes the list endpoints filter/sort on (no-op if they exist)."""
     if db is None:
-        raise HTTPException(status_code=500, detail="Database not available. Set DATABASE_URL and DATABASE_NAME.")
-    return db[name]
+        return
+    # Fail fast before serving traffic if Mongo is configured but unreachable
+    await db.command("ping")
+    try:
+        # Compound with _id to match get_documents' sort("_id", -1), so the
+        # index serves both the filter and the sort with no SORT stage
+        await db.appointment.create_index([("patient_email", 1), ("_id", -1)])
+        await db.prescription.create_index([("patient_email", 1), ("_id", -1)])
+        await db.invoice.create_index([("patient_email", 1), ("_id", -1)])
+        await db.message.create_index([("room", 1), ("_id", -1)])
+    except Exception:
+        pass
+
+
+@app.on_event("shutdown")
+async def drain_message_buffer():
+    """Flush any messages still sitting in the coalescing insert buffer."""
+    await flush_pending_messages()
 
 
 # ---------------------
 # Health & Meta
 # ---------------------
-@app.get("/")
-def root():
-    return {"message": "Nutritionist Backend Running"}
+_HEALTHZ_BYTES = b'{"status":"ok"}'
+
+_ROOT_BYTES = orjson.dumps({"message": "Nutritionist Backend Running"})
+_ROOT_ETAG = f'"{hashlib.md5(_ROOT_BYTES).hexdigest()}"'
+
+_TEST_CACHE_TTL = 10.0
+_test_cache = (0.0, None)  # (expiry, payload)
+
+
+@app.get("/", response_model=None)
+async def root(request: Request):
+    if request.headers.get("if-none-match") == _ROOT_ETAG:
+        return Response(status_code=304, headers={"ETag": _ROOT_ETAG})
+    return Response(
+        content=_ROOT_BYTES,
+        media_type="application/json",
+        headers={"ETag": _ROOT_ETAG},
+    )
 
 
-@app.get("/test")
-def test_database():
+@app.get("/healthz", response_model=None)
+async def healthz():
+    """Cheap liveness probe for load balancers; no DB round-trip."""
+    return Response(content=_HEALTHZ_BYTES, media_type="application/json")
+
+
+@app.get("/test", response_model=None)
+async def test_database():
+    global _test_cache
+    expiry, payload = _test_cache
+    now = time.monotonic()
+    if payload is not None and now < expiry:
+        return payload
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -114,12 +271,13 @@ def test_database():
             response["database_name"] = getattr(db, "name", "✅ Connected")
             response["connection_status"] = "Connected"
             try:
-                response["collections"] = db.list_collection_names()[:10]
+                response["collections"] = (await db.list_collection_names())[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
                 response["database"] = f"⚠️ Connected but Error: {str(e)[:80]}"
     except Exception as e:
         response["database"] = f"❌ Error: {str(e)[:80]}"
+    _test_cache = (now + _TEST_CACHE_TTL, response)
     return response
 
 
@@ -129,6 +287,11 @@ def test_database():
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET", "")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
+# Without JWT_SECRET fall back to a per-process random key rather than a
+# published constant; set the env var in any deployment with restarts or
+# multiple workers, or tokens won't verify across processes.
+JWT_SECRET = os.getenv("JWT_SECRET") or secrets.token_hex(32)
+JWT_TTL_MINUTES = 15
 
 oauth = OAuth()
 if GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET:
@@ -156,17 +319,34 @@ async def google_auth_callback(request: Request):
     try:
         token = await oauth.google.authorize_access_token(request)
         userinfo = token.get("userinfo") or {}
-        # Upsert user in DB
-        if userinfo.get("email"):
-            _ = create_document("user", {
-                "name": userinfo.get("name", "User"),
-                "email": userinfo["email"],
-                "role": "patient",
-                "avatar_url": userinfo.get("picture")
-            })
-        # In real app, issue a session/JWT. For demo, redirect with minimal data.
+        # Upsert user in DB; $setOnInsert means returning users cost no write
+        if userinfo.get("email") and db is not None:
+            now = datetime.now(timezone.utc)
+            await db.user.update_one(
+                {"email": userinfo["email"]},
+                {"$setOnInsert": {
+                    "name": userinfo.get("name", "User"),
+                    "email": userinfo["email"],
+                    "role": "patient",
+                    "avatar_url": userinfo.get("picture"),
+                    "created_at": now,
+                    "updated_at": now,
+                }},
+                upsert=True,
+            )
+        # Hand the user off with a short-lived JWT in the URL fragment so
+        # no PII lands in server/proxy logs.
+        session_token = jwt.encode(
+            {
+                "sub": userinfo.get("email", ""),
+                "name": userinfo.get("name", ""),
+                "exp": datetime.now(timezone.utc) + timedelta(minutes=JWT_TTL_MINUTES),
+            },
+            JWT_SECRET,
+            algorithm="HS256",
+        )
         frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
-        target = f"{frontend_url}/?name={userinfo.get('name','')}&email={userinfo.get('email','')}"
+        target = f"{frontend_url}/#token={session_token}"
         return RedirectResponse(target)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Auth failed: {str(e)[:120]}")
@@ -175,38 +355,53 @@ async def google_auth_callback(request: Request):
 # ---------------------
 # Appointments
 # ---------------------
-@app.post("/api/appointments")
-def create_appointment(payload: Appointment):
-    appt_id = create_document("appointment", payload)
+@app.post("/api/appointments", response_model=None)
+async def create_appointment(payload: Appointment):
+    appt_id = await _limited_create("appointment", payload)
+    await cache_invalidate("appointment")
     return {"id": appt_id, "status": "created"}
 
 
-@app.get("/api/appointments")
-def list_appointments(patient_email: Optional[str] = None, limit: int = 50):
-    filt = {"patient_email": patient_email} if patient_email else {}
-    items = get_documents("appointment", filt, limit)
-    return {"items": [
-        {**{k: (v.isoformat() if hasattr(v, 'isoformat') else v) for k, v in d.items()}, "id": str(d.get("_id"))}
-        for d in items
-    ]}
+@app.get("/api/appointments", response_model=None)
+async def list_appointments(patient_email: Optional[str] = None, limit: int = 50):
+    filt = {"patient_email": patient_email} if patient_email else _EMPTY_FILTER
+    cache_key = f"{patient_email}:{limit}"
+    cached = await cache_get("appointment", cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    items = await get_documents("appointment", filt, limit)
+    for d in items:
+        d["id"] = d["_id"]
+    body = orjson.dumps({"items": items}, default=_orjson_default)
+    await cache_set("appointment", cache_key, body)
+    return Response(content=body, media_type="application/json")
 
 
 # ---------------------
 # Messages (Simple Live Chat)
 # ---------------------
-@app.post("/api/messages")
-def post_message(payload: Message):
-    msg_id = create_document("message", payload)
+@app.post("/api/messages", response_model=None)
+async def post_message(request: Request):
+    payload = _decode_struct(await request.body(), _MESSAGE_DECODER)
+    if payload.sender_email is not None and not _EMAIL_RE.match(payload.sender_email):
+        raise HTTPException(status_code=422, detail="invalid email address")
+    msg_id = await create_message_batched(msgspec.to_builtins(payload))
+    await cache_invalidate("message")
     return {"id": msg_id, "status": "created"}
 
 
-@app.get("/api/messages")
-def get_messages(room: str = "general", limit: int = 50):
-    items = get_documents("message", {"room": room}, limit)
-    return {"items": [
-        {**{k: (v.isoformat() if hasattr(v, 'isoformat') else v) for k, v in d.items()}, "id": str(d.get("_id"))}
-        for d in items
-    ]}
+@app.get("/api/messages", response_model=None)
+async def get_messages(room: str = "general", limit: int = 50):
+    cache_key = f"{room}:{limit}"
+    cached = await cache_get("message", cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    items = await get_documents("message", {"room": room}, limit)
+    for d in items:
+        d["id"] = d["_id"]
+    body = orjson.dumps({"items": items}, default=_orjson_default)
+    await cache_set("message", cache_key, body)
+    return Response(content=body, media_type="application/json")
 
 
 # ---------------------
@@ -215,17 +410,61 @@ def get_messages(room: str = "general", limit: int = 50):
 connections: Dict[str, Set[WebSocket]] = {}
 
 async def _broadcast(room: str, message: str):
-    if room not in connections:
+    sockets = connections.get(room)
+    if not sockets:
         return
-    to_remove = []
-    for ws in list(connections[room]):
+    targets = list(sockets)
+    results = await asyncio.gather(
+        *(ws.send_text(message) for ws in targets),
+        return_exceptions=True,
+    )
+    dead = {ws for ws, result in zip(targets, results) if isinstance(result, Exception)}
+    if dead:
+        sockets.difference_update(dead)
+
+
+_COALESCE_WINDOW = 0.005  # seconds to wait for a follow-up frame
+_COALESCE_MAX = 16
+
+
+async def _receive_batch(websocket: WebSocket):
+    """Drain up to _COALESCE_MAX pending frames so bursts broadcast as one send.
+
+    Returns (frames, disconnected). A disconnect inside the coalescing
+    window is reported instead of raised so the frames already received
+    still get broadcast — send-then-close must not lose the last message.
+    """
+    frames = [await websocket.receive_text()]
+    disconnected = False
+    while len(frames) < _COALESCE_MAX:
         try:
-            await ws.send_text(message)
-        except Exception:
-            to_remove.append(ws)
-    for ws in to_remove:
+            frames.append(await asyncio.wait_for(websocket.receive_text(), timeout=_COALESCE_WINDOW))
+        except asyncio.TimeoutError:
+            break
+        except WebSocketDisconnect:
+            disconnected = True
+            break
+    return frames, disconnected
+
+
+async def _forward_room(websocket: WebSocket, room: str):
+    """Subscribe to the room's Redis channel and forward messages to one socket."""
+    pubsub = redis_client.pubsub()
+    await pubsub.subscribe(f"room:{room}")
+    try:
+        async for msg in pubsub.listen():
+            if msg.get("type") != "message":
+                continue
+            data = msg["data"]
+            if isinstance(data, bytes):
+                data = data.decode()
+            await websocket.send_text(data)
+    except Exception:
+        pass
+    finally:
         try:
-            connections[room].remove(ws)
+            await pubsub.unsubscribe(f"room:{room}")
+            await pubsub.close()
         except Exception:
             pass
 
@@ -233,14 +472,34 @@ async def _broadcast(room: str, message: str):
 @app.websocket("/ws/{room}")
 async def websocket_endpoint(websocket: WebSocket, room: str):
     await websocket.accept()
+    if redis_client is not None:
+        # Multi-worker path: fan out through Redis pub/sub so messages
+        # published on one uvicorn worker reach sockets held by another.
+        forwarder = asyncio.create_task(_forward_room(websocket, room))
+        try:
+            while True:
+                frames, disconnected = await _receive_batch(websocket)
+                data = frames[0] if len(frames) == 1 else orjson.dumps(frames).decode()
+                await redis_client.publish(f"room:{room}", data)
+                if disconnected:
+                    break
+        except WebSocketDisconnect:
+            pass
+        finally:
+            forwarder.cancel()
+        return
+    # Single-process fallback: in-memory room registry
     if room not in connections:
         connections[room] = set()
     connections[room].add(websocket)
     try:
         while True:
-            data = await websocket.receive_text()
-            # Broadcast to room
+            frames, disconnected = await _receive_batch(websocket)
+            # Broadcast to room; bursts go out as one JSON array frame
+            data = frames[0] if len(frames) == 1 else orjson.dumps(frames).decode()
             await _broadcast(room, data)
+            if disconnected:
+                break
     except WebSocketDisconnect:
         pass
     finally:
@@ -253,51 +512,70 @@ async def websocket_endpoint(websocket: WebSocket, room: str):
 # ---------------------
 # Questionnaire
 # ---------------------
-@app.post("/api/questionnaires")
-def submit_questionnaire(payload: QuestionnaireResponse):
-    q_id = create_document("questionnaireresponse", payload)
+@app.post("/api/questionnaires", response_model=None)
+async def submit_questionnaire(payload: QuestionnaireResponse):
+    q_id = await _limited_create("questionnaireresponse", payload)
     return {"id": q_id, "status": "submitted"}
 
 
 # ---------------------
 # Prescriptions
 # ---------------------
-@app.post("/api/prescriptions")
-def create_prescription(payload: Prescription):
-    p_id = create_document("prescription", payload)
+@app.post("/api/prescriptions", response_model=None)
+async def create_prescription(payload: Prescription):
+    p_id = await _limited_create("prescription", payload)
+    await cache_invalidate("prescription")
     return {"id": p_id, "status": "created"}
 
 
-@app.get("/api/prescriptions")
-def list_prescriptions(patient_email: Optional[str] = None, limit: int = 50):
-    filt = {"patient_email": patient_email} if patient_email else {}
-    items = get_documents("prescription", filt, limit)
-    return {"items": [
-        {**{k: (v.isoformat() if hasattr(v, 'isoformat') else v) for k, v in d.items()}, "id": str(d.get("_id"))}
-        for d in items
-    ]}
+@app.get("/api/prescriptions", response_model=None)
+async def list_prescriptions(patient_email: Optional[str] = None, limit: int = 50):
+    filt = {"patient_email": patient_email} if patient_email else _EMPTY_FILTER
+    cache_key = f"{patient_email}:{limit}"
+    cached = await cache_get("prescription", cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    items = await get_documents("prescription", filt, limit)
+    for d in items:
+        d["id"] = d["_id"]
+    body = orjson.dumps({"items": items}, default=_orjson_default)
+    await cache_set("prescription", cache_key, body)
+    return Response(content=body, media_type="application/json")
 
 
 # ---------------------
 # Invoices
 # ---------------------
-@app.post("/api/invoices")
-def create_invoice(payload: Invoice):
-    inv_id = create_document("invoice", payload)
+@app.post("/api/invoices", response_model=None)
+async def create_invoice(request: Request):
+    payload = _decode_struct(await request.body(), _INVOICE_DECODER)
+    if not _EMAIL_RE.match(payload.patient_email):
+        raise HTTPException(status_code=422, detail="invalid email address")
+    inv_id = await _limited_create("invoice", msgspec.to_builtins(payload))
+    await cache_invalidate("invoice")
     return {"id": inv_id, "status": "created"}
 
 
-@app.get("/api/invoices")
-def list_invoices(patient_email: Optional[str] = None, limit: int = 50):
-    filt = {"patient_email": patient_email} if patient_email else {}
-    items = get_documents("invoice", filt, limit)
-    return {"items": [
-        {**{k: (v.isoformat() if hasattr(v, 'isoformat') else v) for k, v in d.items()}, "id": str(d.get("_id"))}
-        for d in items
-    ]}
+@app.get("/api/invoices", response_model=None)
+async def list_invoices(patient_email: Optional[str] = None, limit: int = 50, summary: bool = False):
+    filt = {"patient_email": patient_email} if patient_email else _EMPTY_FILTER
+    cache_key = f"{patient_email}:{limit}:{summary}"
+    cached = await cache_get("invoice", cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    # summary=true skips the line items, so Mongo ships totals only
+    projection = {"items": 0} if summary else None
+    items = await get_documents("invoice", filt, limit, projection)
+    for d in items:
+        d["id"] = d["_id"]
+    body = orjson.dumps({"items": items}, default=_orjson_default)
+    await cache_set("invoice", cache_key, body)
+    return Response(content=body, media_type="application/json")
 
 
 if __name__ == "__main__":
+    # Single-process dev server; production runs gunicorn with UvicornWorker
+    # via start_server.sh for one worker per core.
     import uvicorn
     port = int(os.getenv("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
@@ -2,9 +2,9 @@
 echo "Starting FastAPI backend server..."
 
 # Find and kill MainThread processes
-PIDS=$(ps | grep uvicorn | grep -v grep | awk '{print $1}')
+PIDS=$(ps | grep -E 'gunicorn|uvicorn' | grep -v grep | awk '{print $1}')
 if [ ! -z "$PIDS" ]; then
-  echo "Killing uvicorn processes: $PIDS"
+  echo "Killing server processes: $PIDS"
   for pid in $PIDS; do
     kill $pid 2>/dev/null || true
   done
@@ -15,5 +15,11 @@ mkdir -p logs
 echo "Installing dependencies..."
 pip install -r requirements.txt
 echo "Starting FastAPI server..."
-nohup uvicorn main:app --host 0.0.0.0 --port 8000 --reload > logs/server.log 2>&1 
-echo "Server started in background"
+# 2*cpu+1 workers; uvicorn[standard] gives each one uvloop + httptools
+WORKERS=${WEB_CONCURRENCY:-$((2 * $(nproc) + 1))}
+nohup gunicorn main:app \
+  -k uvicorn.workers.UvicornWorker \
+  -w "$WORKERS" \
+  --worker-connections 1000 \
+  --bind 0.0.0.0:8000 > logs/server.log 2>&1 &
+echo "Server started in background with $WORKERS workers"